@@ -1,3 +1,4 @@
 from __future__ import absolute_import
 
-from .target_phasing import MultiqcModule, Target, add_fake_file_pattern
+from .target_phasing import MultiqcModule, Target, add_fake_file_pattern, \
+        block_statistics, n50, parse_sample, phase_switches
@@ -3,6 +3,8 @@ from multiqc.utils import config
 from multiqc.plots import bargraph
 
 import json
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import OrderedDict
 
 class MultiqcModule(BaseMultiqcModule):
@@ -20,6 +22,8 @@ class MultiqcModule(BaseMultiqcModule):
         )
 
         self.whatshap = dict()
+        self.block_stats = dict()
+        self.block_summary = dict()
         self.genes = list()
         self.parse_blocklist_files()
         self.plot_phasing_per_sample()
@@ -61,18 +65,12 @@ class MultiqcModule(BaseMultiqcModule):
     def parse_blocklist_files(self):
         # For each sample (defined in a blocklist)
         for sample, filename in zip(self.samples, self.blocklist):
-            self.whatshap[sample] = dict()
-            # For each of the target genes
-            for target in self.parse_target_genes():
-                # We store a dictionary for every gene
-                self.whatshap[sample][target.name] = dict()
-                self.genes.append(target.name)
-                # We update the phasing of the target based on the blocklist
-                self.update_phasing(filename, target)
-
-                # We store the size of each phased and unphased block
-                for begin, end, phasing in target.all_regions():
-                    self.whatshap[sample][target.name][phasing] = end-begin
+            targets = self.parse_target_genes()
+            phasing, block_stats, block_summary = parse_sample(filename, targets)
+            self.whatshap[sample] = phasing
+            self.block_stats[sample] = block_stats
+            self.block_summary[sample] = block_summary
+            self.genes += list(phasing)
 
     def parse_target_genes(self):
         with open(self.target_genes) as fin:
@@ -82,35 +80,17 @@ class MultiqcModule(BaseMultiqcModule):
                 end = int(end)
                 yield Target(chrom, begin, end, name)
 
-    def update_phasing(self, filename, target):
-        with open(filename) as fin:
-            # If filename is an empty file, we are done
-            try:
-                header = next(fin).strip().split()
-            except StopIteration:
-                return
-
-            # Did we get the expected header
-            assert header == ['#sample', 'chromosome', 'phase_set', 'from', 'to', 'variants']
-
-            # Start parsing the file
-            for line in fin:
-                spline = line.strip().split()
-                chrom = spline[1]
-                begin = int(spline[3])
-                end = int(spline[4])
-                # The positions in the blocklist are 1 based inclusive, see
-                # https://whatshap.readthedocs.io/en/latest/guide.html#writing-haplotype-blocks-in-tsv-format
-                # for details.
-                #
-                # In short, all we need to do to make this compatible with the
-                # Target class is to decrement begin by 1
-                begin -= 1
-                target.update([(chrom, begin, end)])
-
     def write_data_files(self):
         self.write_data_file(self.whatshap, 'multiqc_pgx_phasing')
         self.write_data_file(self.phase_summary, 'multiqc_pgx_phase_summary')
+        # Write a row for every gene of every sample, since the data file
+        # cannot contain nested dictionaries
+        block_stats = {
+            f'{sample} - {gene}': stats
+            for sample in self.block_stats
+            for gene, stats in self.block_stats[sample].items()
+        }
+        self.write_data_file(block_stats, 'multiqc_pgx_block_stats')
 
     def plot_phasing_per_sample(self):
         """ Plot the phasing of all genes for each sample """
@@ -371,7 +351,8 @@ class MultiqcModule(BaseMultiqcModule):
 
         Determines the phased and unphased totals, and also the fraction
         (between 0 and 1) of phased and unphased bases, relative to the total
-        number of target bases.
+        number of target bases. The phased block statistics, which are
+        determined while parsing the blocklist files, are added as well.
 
         """
         phase_summary = dict()
@@ -403,6 +384,7 @@ class MultiqcModule(BaseMultiqcModule):
                         'phased': phased,
                         'frac_phased': round(phased / target_bp, 3)
                         }
+            phase_summary[sample].update(self.block_summary[sample])
 
         return phase_summary
 
@@ -438,6 +420,59 @@ class MultiqcModule(BaseMultiqcModule):
                 'suffix' : '%',
                 'hidden' : False
                 }
+            ),
+            ('block_n50', {
+                'id': 'phased_block_n50',
+                'title': 'Block N50',
+                'description':
+                    'N50 of the phased blocks within the target genes',
+                'format': '{:,.0f}',
+                'suffix': ' bp',
+                'hidden' : False
+                }
+            ),
+            ('largest_block', {
+                'id': 'largest_phased_block',
+                'title': 'Largest block',
+                'description':
+                    'Size of the largest phased block within the target '
+                    'genes',
+                'format': '{:,.0f}',
+                'suffix': ' bp',
+                'hidden' : True
+                }
+            ),
+            ('phased_blocks', {
+                'id': 'phased_blocks',
+                'title': 'Phased blocks',
+                'description':
+                    'Number of phased blocks within the target genes, a '
+                    'phase set that spans multiple genes is counted once '
+                    'for each gene',
+                'format': '{:,.0f}',
+                'hidden' : True
+                }
+            ),
+            ('phase_switches', {
+                'id': 'phase_switches',
+                'title': 'Phase switches',
+                'description':
+                    'Number of switches between phase sets within the target '
+                    'genes',
+                'format': '{:,.0f}',
+                'hidden' : True
+                }
+            ),
+            ('variants_phased', {
+                'id': 'variants_phased',
+                'title': 'Est. phased variants',
+                'description':
+                    'Estimated number of phased variants within the target '
+                    'genes, assuming the variants are spread evenly across '
+                    'each phase set',
+                'format': '{:,.0f}',
+                'hidden' : True
+                }
             )
         ])
 
@@ -453,12 +488,128 @@ class MultiqcModule(BaseMultiqcModule):
         self.general_stats_addcols(general_stats, general_stats_headers)
 
 
+def parse_sample(filename, targets):
+    """
+    Determine the phasing and the block statistics of the targets for the
+    blocklist of a single sample
+
+    Returns the size of each phased and unphased block for every target, the
+    block statistics for every target, and the block statistics across all
+    targets.
+    """
+    phasing = dict()
+    block_stats = dict()
+    # The phased block sizes, phase set switches and phased variants across
+    # all targets. Like the phased blocks, the variants are counted within
+    # each target, so a phase set spanning two targets is split between them
+    sample_blocks = list()
+    sample_switches = 0
+    sample_variants = 0
+    for target in targets:
+        # We update the phasing of the target based on the blocklist
+        update_phasing(filename, target)
+
+        # We store the size of each phased and unphased block, and collect the
+        # phased block sizes and their phase sets for the block statistics
+        phasing[target.name] = dict()
+        gene_blocks = list()
+        phase_sets = list()
+        for begin, end, label, phase_set in target.all_regions():
+            phasing[target.name][label] = end-begin
+            if phase_set is not None:
+                gene_blocks.append(end-begin)
+                phase_sets.append(phase_set)
+
+        switches = phase_switches(phase_sets)
+        stats = block_statistics(gene_blocks)
+        stats['phase_switches'] = switches
+        stats['variants_phased'] = round(target.variants)
+        block_stats[target.name] = stats
+
+        sample_blocks += gene_blocks
+        sample_switches += switches
+        sample_variants += target.variants
+
+    block_summary = block_statistics(sample_blocks)
+    block_summary['phase_switches'] = sample_switches
+    block_summary['variants_phased'] = round(sample_variants)
+    return phasing, block_stats, block_summary
+
+
+def update_phasing(filename, target):
+    """ Update the phasing of the target based on the blocklist """
+    with open(filename) as fin:
+        # If filename is an empty file, we are done
+        try:
+            header = next(fin).strip().split()
+        except StopIteration:
+            return
+
+        # Did we get the expected header
+        assert header == ['#sample', 'chromosome', 'phase_set', 'from', 'to', 'variants']
+
+        # Start parsing the file
+        for line in fin:
+            spline = line.strip().split()
+            chrom = spline[1]
+            phase_set = int(spline[2])
+            begin = int(spline[3])
+            end = int(spline[4])
+            variants = int(spline[5])
+            # The positions in the blocklist are 1 based inclusive, see
+            # https://whatshap.readthedocs.io/en/latest/guide.html#writing-haplotype-blocks-in-tsv-format
+            # for details.
+            #
+            # In short, all we need to do to make this compatible with the
+            # Target class is to decrement begin by 1
+            begin -= 1
+            target.update([(chrom, begin, end, phase_set, variants)])
+
+
+def phase_switches(phase_sets):
+    """ Count the switches between consecutive phase sets """
+    return sum(
+        previous != current
+        for previous, current in zip(phase_sets, phase_sets[1:])
+    )
+
+
+def n50(lengths):
+    """ Determine the N50 of the block lengths
+
+    The N50 is the length of the block for which the blocks of that length or
+    longer cover at least half of the total length. Returns 0 when there are
+    no blocks.
+    """
+    total = sum(lengths)
+    covered = 0
+    for length in sorted(lengths, reverse=True):
+        covered += length
+        if covered * 2 >= total:
+            return length
+    return 0
+
+
+def block_statistics(lengths):
+    """ Determine the statistics for the phased block lengths """
+    return {
+        'phased_blocks': len(lengths),
+        'largest_block': max(lengths, default=0),
+        'block_n50': n50(lengths)
+    }
+
+
 class Target():
     """
     Class to store the target region in. At initialisation, the entire region
     is unphased. The phasing can be updated by passing phased regions to
     Target.
 
+    The phased regions are stored as sorted, non-overlapping intervals in
+    three integer arrays (begin, end and phase set), so the memory use depends
+    on the number of phased blocks, not on the size of the target. Adjacent
+    regions are only merged when they belong to the same phase set.
+
     The begin and end positions are in the typical python format, i.e. 0 based
     and excluding the last position.
     """
@@ -467,97 +618,143 @@ class Target():
         self.name = name
         self.begin = begin
         self.end = end
-        self.phasing = '-' * (end-begin)
+        self.starts = array('q')
+        self.ends = array('q')
+        self.phase_sets = array('q')
+        # The number of variants per base for each phase set in the target
+        self.phase_set_density = dict()
 
     def __repr__(self):
         return self.phasing
 
+    @property
+    def variants(self):
+        """
+        The estimated number of phased variants in the target
+
+        The blocklist only contains the number of variants of each phase set,
+        so we assume they are spread evenly across the phase set.
+        """
+        return sum(
+            (end-begin) * self.phase_set_density[phase_set]
+            for begin, end, phase_set in zip(self.starts, self.ends,
+                                             self.phase_sets)
+        )
+
+    @property
+    def phasing(self):
+        """ The phasing of every base in the target, as a string of + and - """
+        phasing = list()
+        previous = self.begin
+        for begin, end in self.phased():
+            phasing.append('-' * (begin-previous))
+            phasing.append('+' * (end-begin))
+            previous = end
+        phasing.append('-' * (self.end-previous))
+        return ''.join(phasing)
+
+    @phasing.setter
+    def phasing(self, phasing):
+        """ Set the phasing from a string of + and -, as a single phase set """
+        self.starts = array('q')
+        self.ends = array('q')
+        self.phase_sets = array('q')
+        self.phase_set_density = {0: 0}
+        for i, phased in enumerate(phasing):
+            if phased != '+':
+                continue
+            pos = i + self.begin
+            # Extend the previous phased block if it ends here
+            if self.ends and self.ends[-1] == pos:
+                self.ends[-1] = pos + 1
+            else:
+                self.starts.append(pos)
+                self.ends.append(pos + 1)
+                self.phase_sets.append(0)
+
     def phased(self):
-        phased = False
-        phase_start = None
-        for i in range(len(self.phasing)):
-            # If we find a new phased block
-            if self.phasing[i] == '+' and not phased:
-                phase_start = i
-                phased = True
-            # If we come to the end of the phased block
-            if self.phasing[i] == '-' and phased:
-                # We have to offset the start of self
-                yield (phase_start+self.begin, i+self.begin)
-                phased = False
-        # If we are at the end of the Target and we were in a phased block
-        else:
-            if phased:
-                yield(phase_start+self.begin, i+1+self.begin)
+        for begin, end in zip(self.starts, self.ends):
+            yield (begin, end)
 
     def all_regions(self):
-        phased = self.phasing[0] == '+'
-        block_start = 0
+        """
+        Yield every phased and unphased block in the target, together with
+        the phase set of the block (None for unphased blocks)
+        """
         phased_count = 0
         unphased_count = 0
-        for i in range(len(self.phasing)):
-            # If we find a phased block while we were unphased
-            if self.phasing[i] == '+' and not phased:
+        previous = self.begin
+        for begin, end, phase_set in zip(self.starts, self.ends,
+                                         self.phase_sets):
+            # If there is an unphased block before this phased block
+            if begin > previous:
                 unphased_count += 1
-                yield (block_start + self.begin, i + self.begin, f'unphased-{unphased_count}')
-                block_start = i
-                phased = True
-            # If we find an unphased block while we were phased
-            if self.phasing[i] == '-' and phased:
-                phased_count += 1
-                # We have to offset the start of self
-                yield (block_start + self.begin, i + self.begin, f'phased-{phased_count}')
-                block_start = i
-                phased = False
-        # If we are at the end of the Target
-        if phased:
-            yield(block_start+self.begin, i+1+self.begin, f'phased-{phased_count+1}')
-        else:
-            yield(block_start+self.begin, i+1+self.begin, f'unphased-{unphased_count+1}')
+                yield (previous, begin, f'unphased-{unphased_count}', None)
+            phased_count += 1
+            yield (begin, end, f'phased-{phased_count}', phase_set)
+            previous = end
+        # If we are not at the end of the Target
+        if previous < self.end:
+            unphased_count += 1
+            yield (previous, self.end, f'unphased-{unphased_count}', None)
 
     def update(self, regions):
-        """ Update the phasing according to the regions """
-        old_length = len(self.phasing)
+        """
+        Update the phasing according to the regions
+
+        Each region is a tuple of (chrom, begin, end, phase_set, variants)
+        """
         for region in regions:
-            chrom, begin, end = region
+            chrom, begin, end, phase_set, variants = region
             size = end-begin
             # If the region is on a different chromosome, we are done
             if chrom != self.chrom:
                 continue
 
-            # If both begin and end are in the target
-            if begin >= self.begin and end <= self.end:
-                #print(f'{region} is contained within target ({self.chrom}:{self.begin}-{self.end})')
-                # The phasing of the first part stays the same
-                first = self.phasing[:begin-self.begin]
-                # Then we add the newly phased part, which is smaller than wat
-                # is left
-                size = end - begin
-                phased = '+' * size
-                # Then the rest of the phasing
-                rest = len(first) + size
-                last = self.phasing[rest:]
-                self.phasing = first + phased + last
-
-            # If the beginning is in the target, but the end is not
-            elif begin >= self.begin and end > self.end:
-                #print(f'{region} overlaps the end of target ({self.chrom}:{self.begin}-{self.end}))')
-                # The size of the target region counting from begin
-                rest = len(self.phasing)-begin
-                self.phasing = self.phasing[:begin] + '+'*rest
-
-            # If region completely overlaps the target
-            elif begin <= self.begin and end >= self.end:
-                #print(f'{region} overlaps the target completely ({self.chrom}:{self.begin}-{self.end}))')
-                self.phasing = '+'*len(self.phasing)
-
-            # If the beginning is before the target, but the ending is in the
-            # target
-            elif begin <= self.begin and end <= self.end and end >= self.begin:
-                #print(f'{region} overlaps the beginning of target ({self.chrom}:{self.begin}-{self.end}))')
-                rest = end-self.begin
-                self.phasing = '+' * rest + self.phasing[rest:]
-        assert old_length == len(self.phasing), f'Error in {region}'
+            # Only the part of the region inside the target is of interest
+            begin = max(begin, self.begin)
+            end = min(end, self.end)
+            if begin >= end:
+                continue
+
+            self.phase_set_density[phase_set] = variants / size
+            self._insert(begin, end, phase_set)
+
+    def _insert(self, begin, end, phase_set):
+        """ Insert a phased interval, replacing what was there before """
+        # The existing intervals which overlap or touch the new interval
+        first = bisect_left(self.ends, begin)
+        last = bisect_right(self.starts, end)
+
+        starts = list()
+        ends = list()
+        phase_sets = list()
+        for i in range(first, last):
+            # Merge with intervals from the same phase set
+            if self.phase_sets[i] == phase_set:
+                begin = min(begin, self.starts[i])
+                end = max(end, self.ends[i])
+                continue
+            # Keep the parts of other phase sets outside the new interval
+            if self.starts[i] < begin:
+                starts.append(self.starts[i])
+                ends.append(min(self.ends[i], begin))
+                phase_sets.append(self.phase_sets[i])
+            if self.ends[i] > end:
+                starts.append(max(self.starts[i], end))
+                ends.append(self.ends[i])
+                phase_sets.append(self.phase_sets[i])
+
+        # Since the intervals do not overlap, at most one part of the
+        # existing intervals comes before the new interval
+        position = 1 if starts and starts[0] < begin else 0
+        starts.insert(position, begin)
+        ends.insert(position, end)
+        phase_sets.insert(position, phase_set)
+
+        self.starts[first:last] = array('q', starts)
+        self.ends[first:last] = array('q', ends)
+        self.phase_sets[first:last] = array('q', phase_sets)
 
 def add_fake_file_pattern():
     """ Add a fake file pattern to the target_phasing module. This file pattern
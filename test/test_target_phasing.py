@@ -7,7 +7,8 @@ import sys
 # But the preferred way is to use run_tests.sh
 sys.path.insert(0,'../MultiQC_PGx')
 
-from multiqc_pgx.modules.target_phasing import Target
+from multiqc_pgx.modules.target_phasing import Target, block_statistics, n50, \
+        parse_sample, phase_switches
 
 # target, phased_blocks, result
 TARGETS = [
@@ -35,6 +36,32 @@ PHASED = [
         (Target('chr1', 5, 10, 'test'), '-----', []),
 ]
 
+# target, phased_blocks with phase set and variants, result
+PHASE_SETS = [
+        (Target('chr1', 0, 5, 'test'), [('chr1', 0, 2, 1, 3), ('chr1', 2, 5, 1, 2)],
+            [(0, 5, 'phased-1', 1)]),
+        (Target('chr1', 0, 5, 'test'), [('chr1', 0, 2, 1, 3), ('chr1', 2, 5, 3, 2)],
+            [(0, 2, 'phased-1', 1), (2, 5, 'phased-2', 3)]),
+        (Target('chr1', 0, 5, 'test'), [('chr1', 1, 2, 1, 3), ('chr1', 3, 4, 3, 2)],
+            [(0, 1, 'unphased-1', None), (1, 2, 'phased-1', 1),
+             (2, 3, 'unphased-2', None), (3, 4, 'phased-2', 3),
+             (4, 5, 'unphased-3', None)]),
+        (Target('chr1', 0, 6, 'test'), [('chr1', 0, 6, 1, 3), ('chr1', 2, 4, 3, 2)],
+            [(0, 2, 'phased-1', 1), (2, 4, 'phased-2', 3), (4, 6, 'phased-3', 1)]),
+        (Target('chr1', 5, 10, 'test'), [('chr1', 0, 7, 1, 3), ('chr1', 7, 20, 3, 2)],
+            [(5, 7, 'phased-1', 1), (7, 10, 'phased-2', 3)]),
+]
+
+# lengths, n50
+N50 = [
+        ([], 0),
+        ([5], 5),
+        ([1, 2, 3], 3),
+        ([2, 2, 3, 3], 3),
+        ([1, 1, 1, 10], 10),
+        ([4, 3, 2, 1], 3),
+]
+
 def test_target():
     T = Target('chr1', 10, 20, 'test')
     assert T.name == 'test'
@@ -44,10 +71,140 @@ def test_target():
 
 @pytest.mark.parametrize(['target', 'phased', 'result'], TARGETS)
 def test_phased_target(target, phased, result):
-    target.update(phased)
+    # All phased regions belong to the same phase set, without variants
+    target.update([(chrom, begin, end, 0, 0) for chrom, begin, end in phased])
     assert str(target) == result
 
 @pytest.mark.parametrize(['target', 'phasing', 'result'], PHASED)
 def test_phased(target, phasing, result):
     target.phasing = phasing
     assert list(target.phased()) == result
+
+@pytest.mark.parametrize(['target', 'phased', 'result'], PHASE_SETS)
+def test_phase_set_regions(target, phased, result):
+    target.update(phased)
+    assert list(target.all_regions()) == result
+
+def test_phased_variants():
+    T = Target('chr1', 10, 20, 'test')
+    T.update([('chr1', 0, 12, 1, 12), ('chr1', 15, 30, 2, 30), ('chr1', 30, 40, 3, 5)])
+    # Only the variants of the part of each phase set in the target count
+    assert T.variants == 12
+
+def test_phased_variants_large_phase_set():
+    T = Target('chr1', 0, 10, 'test')
+    T.update([('chr1', 0, 1000000, 1, 50000)])
+    assert T.variants == pytest.approx(0.5)
+
+def test_phased_variants_overwritten_phase_set():
+    T = Target('chr1', 0, 10, 'test')
+    T.update([('chr1', 0, 10, 1, 100), ('chr1', 0, 10, 2, 5)])
+    assert list(T.all_regions()) == [(0, 10, 'phased-1', 2)]
+    assert T.variants == 5
+
+def test_update_requires_phase_set():
+    T = Target('chr1', 0, 10, 'test')
+    with pytest.raises(ValueError):
+        T.update([('chr1', 0, 5)])
+
+@pytest.mark.parametrize(['lengths', 'result'], N50)
+def test_n50(lengths, result):
+    assert n50(lengths) == result
+
+def test_block_statistics():
+    stats = block_statistics([4, 3, 2, 1])
+    assert stats == {'phased_blocks': 4, 'largest_block': 4, 'block_n50': 3}
+
+def test_block_statistics_empty():
+    stats = block_statistics([])
+    assert stats == {'phased_blocks': 0, 'largest_block': 0, 'block_n50': 0}
+
+BLOCKLIST_HEADER = '#sample\tchromosome\tphase_set\tfrom\tto\tvariants\n'
+
+# phase_sets, switches
+SWITCHES = [
+        ([], 0),
+        ([1], 0),
+        ([1, 1], 0),
+        ([1, 2], 1),
+        ([1, 2, 1], 2),
+]
+
+def parse_blocklist(tmp_path, targets, blocklist):
+    """ Run parse_sample on the targets and blocklist of sample s """
+    blocklist_file = tmp_path / 's.phased.blocklist'
+    blocklist_file.write_text(BLOCKLIST_HEADER + ''.join(
+        '\t'.join(map(str, ('s',) + block)) + '\n' for block in blocklist))
+    targets = [Target(*target) for target in targets]
+    return parse_sample(str(blocklist_file), targets)
+
+@pytest.mark.parametrize(['phase_sets', 'result'], SWITCHES)
+def test_phase_switches(phase_sets, result):
+    assert phase_switches(phase_sets) == result
+
+def test_parse_sample_block_stats(tmp_path):
+    targets = [('chr1', 0, 100, 'GENEA'), ('chr2', 0, 50, 'GENEB')]
+    # chromosome, phase_set, from, to, variants (1 based, inclusive)
+    blocklist = [
+            ('chr1', 5, 5, 40, 10),
+            ('chr1', 50, 50, 60, 4),
+            ('chr1', 70, 70, 90, 3),
+            ('chr2', 1, 1, 50, 8),
+    ]
+    phasing, block_stats, block_summary = parse_blocklist(tmp_path, targets, blocklist)
+
+    assert phasing['GENEB'] == {'phased-1': 50}
+    assert block_stats == {
+        'GENEA': {'phased_blocks': 3, 'largest_block': 36, 'block_n50': 36,
+                  'phase_switches': 2, 'variants_phased': 17},
+        'GENEB': {'phased_blocks': 1, 'largest_block': 50, 'block_n50': 50,
+                  'phase_switches': 0, 'variants_phased': 8},
+    }
+    assert block_summary == {'phased_blocks': 4, 'largest_block': 50,
+                             'block_n50': 36, 'phase_switches': 2,
+                             'variants_phased': 25}
+
+def test_parse_sample_touching_phase_sets(tmp_path):
+    targets = [('chr1', 0, 20, 'GENEA')]
+    # The phase sets are listed out of order, and touch each other
+    blocklist = [
+            ('chr1', 11, 11, 20, 5),
+            ('chr1', 1, 1, 10, 2),
+    ]
+    phasing, block_stats, block_summary = parse_blocklist(tmp_path, targets, blocklist)
+
+    # The touching phase sets are separate phased blocks
+    assert phasing == {'GENEA': {'phased-1': 10, 'phased-2': 10}}
+    assert block_stats['GENEA']['phase_switches'] == 1
+    assert block_summary['phase_switches'] == 1
+
+def test_parse_sample_unphased(tmp_path):
+    targets = [('chr1', 0, 100, 'GENEA')]
+    phasing, block_stats, block_summary = parse_blocklist(tmp_path, targets, [])
+
+    stats = {'phased_blocks': 0, 'largest_block': 0, 'block_n50': 0,
+             'phase_switches': 0, 'variants_phased': 0}
+    assert phasing == {'GENEA': {'unphased-1': 100}}
+    assert block_stats == {'GENEA': stats}
+    assert block_summary == stats
+
+def test_parse_sample_phase_set_spanning_targets(tmp_path):
+    targets = [('chr1', 0, 20, 'GENEA'), ('chr1', 20, 40, 'GENEB')]
+    # Phase set 11 touches phase set 1, and spans both targets
+    blocklist = [
+            ('chr1', 1, 1, 10, 2),
+            ('chr1', 11, 11, 30, 6),
+    ]
+    phasing, block_stats, block_summary = parse_blocklist(tmp_path, targets, blocklist)
+
+    # The variants of phase set 11 are split between the targets
+    assert block_stats == {
+        'GENEA': {'phased_blocks': 2, 'largest_block': 10, 'block_n50': 10,
+                  'phase_switches': 1, 'variants_phased': 5},
+        'GENEB': {'phased_blocks': 1, 'largest_block': 10, 'block_n50': 10,
+                  'phase_switches': 0, 'variants_phased': 3},
+    }
+    # Like the variants, phase set 11 is counted as a block in each target
+    assert block_summary == {'phased_blocks': 3, 'largest_block': 10,
+                             'block_n50': 10, 'phase_switches': 1,
+                             'variants_phased': 8}